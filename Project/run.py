@@ -1,6 +1,17 @@
 #!/usr/bin/env python3
 """
 Run script for the Chat AI Share backend
+
+Serves the app with gunicorn + uvicorn workers so requests are spread over several
+processes. The app is imported once here, before the workers fork (same as gunicorn
+--preload), so read-only memory is shared copy-on-write. Equivalent CLI:
+
+    WEB_CONCURRENCY=$((2*$(nproc))) gunicorn utils.main:app -k uvicorn_worker.UvicornWorker \
+        -b 0.0.0.0:8000 --worker-tmp-dir /dev/shm --preload
+
+Set WEB_CONCURRENCY to change the worker count; the app reads it too, to split the CPUs
+between the workers' extraction pools. Falls back to a single uvicorn process where
+gunicorn is unavailable (e.g. Windows).
 """
 import sys
 import os
@@ -8,9 +19,50 @@ import os
 # Add the current directory to Python path
 sys.path.insert(0, os.path.dirname(__file__))
 
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    BaseApplication = None
+
+# Export the worker count before the app is imported: it sizes its process pools from it
+if BaseApplication is not None:
+    os.environ.setdefault("WEB_CONCURRENCY", str(2 * (os.cpu_count() or 1)))
+
 # Import and run the main application
 from utils.main import app
 import uvicorn
 
+HOST = "0.0.0.0"
+PORT = 8000
+
+
+if BaseApplication is not None:
+    class GunicornApp(BaseApplication):
+        """Run an already-imported ASGI app under gunicorn"""
+
+        def __init__(self, application, options=None):
+            self.options = options or {}
+            self.application = application
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                if key in self.cfg.settings and value is not None:
+                    self.cfg.set(key.lower(), value)
+
+        def load(self):
+            return self.application
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    if BaseApplication is None:
+        uvicorn.run(app, host=HOST, port=PORT)
+    else:
+        options = {
+            "bind": f"{HOST}:{PORT}",
+            "workers": int(os.environ["WEB_CONCURRENCY"]),
+            "worker_class": "uvicorn_worker.UvicornWorker",
+            # Heartbeat files on tmpfs avoid workers stalling on slow disks
+            "worker_tmp_dir": "/dev/shm" if os.path.isdir("/dev/shm") else None,
+        }
+        GunicornApp(app, options).run()
@@ -0,0 +1,67 @@
+# services/embedding_cache.py
+import asyncio
+import hashlib
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from diskcache import Cache
+from langchain_core.embeddings import Embeddings
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that caches document vectors on disk by content hash"""
+
+    def __init__(self, embeddings: Embeddings, cache: Cache, namespace: str):
+        self.embeddings = embeddings
+        self.cache = cache
+        # Vectors from different models aren't interchangeable, so keys are namespaced by model
+        self.namespace = namespace
+
+    def _key(self, text: str) -> str:
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+        return f"{self.namespace}:{digest}"
+
+    def _lookup(self, texts: List[str]) -> Tuple[List[Optional[List[float]]], List[str]]:
+        """Return cached vectors (None for misses) and the distinct texts that missed"""
+        vectors = []
+        misses: Dict[str, None] = {}
+        for text in texts:
+            cached = self.cache.get(self._key(text))
+            if cached is None:
+                misses[text] = None
+                vectors.append(None)
+            else:
+                vectors.append(np.frombuffer(cached, dtype=np.float32).tolist())
+        return vectors, list(misses)
+
+    def _store(self, texts: List[str], vectors: List[List[float]]):
+        for text, vector in zip(texts, vectors):
+            self.cache[self._key(text)] = np.asarray(vector, dtype=np.float32).tobytes()
+
+    @staticmethod
+    def _merge(texts: List[str], vectors: List[Optional[List[float]]],
+               misses: List[str], embedded: List[List[float]]) -> List[List[float]]:
+        fresh = dict(zip(misses, embedded))
+        return [vector if vector is not None else fresh[text] for text, vector in zip(texts, vectors)]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors, misses = self._lookup(texts)
+        if not misses:
+            return vectors
+        embedded = self.embeddings.embed_documents(misses)
+        self._store(misses, embedded)
+        return self._merge(texts, vectors, misses, embedded)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        # Cache lookups hit SQLite, so keep them off the event loop
+        vectors, misses = await asyncio.to_thread(self._lookup, texts)
+        if not misses:
+            return vectors
+        embedded = await self.embeddings.aembed_documents(misses)
+        await asyncio.to_thread(self._store, misses, embedded)
+        return self._merge(texts, vectors, misses, embedded)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.embeddings.aembed_query(text)
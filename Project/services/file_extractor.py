@@ -1,53 +1,205 @@
 import io
+import os
+import re
+import multiprocessing
 import zipfile
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
 import pandas as pd
+import pymupdf
 from PyPDF2 import PdfReader
 from docx import Document
-from typing import Tuple
+from services.process_pool import LazyProcessPool
+from typing import Optional, Tuple, Union, BinaryIO
+
+# PDFs with more pages than this are split across worker processes
+PARALLEL_PDF_PAGE_THRESHOLD = 20
+
+# Plain-text extraction flags: never collect images (TEXT_PRESERVE_IMAGES) during parsing
+PDF_TEXT_FLAGS = pymupdf.TEXTFLAGS_TEXT & ~pymupdf.TEXT_PRESERVE_IMAGES
+
+# Pages whose content streams take at least this much space in the file (usually
+# compressed) are checked for text before being interpreted
+LARGE_CONTENT_STREAM = 256 * 1024
+
+# Direct /Length of a stream; streams never live inside object streams, so a scan of the raw
+# file sees them all (an indirect /Length just means the pages are extracted unchecked)
+_STREAM_LENGTH = re.compile(rb"/Length\s+(\d+)")
+
+# Extractors accept raw bytes or a readable, seekable binary file object
+FileSource = Union[bytes, BinaryIO]
+
+# Shared process pool used for large PDFs
+_pdf_pool = LazyProcessPool()
+
+
+def _as_stream(source: FileSource) -> BinaryIO:
+    """Return a file object positioned at the start of the content"""
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    source.seek(0)
+    return source
+
+
+def _as_bytes(source: FileSource) -> bytes:
+    """Return the full content as bytes"""
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    source.seek(0)
+    return source.read()
+
+
+def _has_large_stream(file_bytes: bytes) -> bool:
+    """True if any stream in the PDF file is at least ``LARGE_CONTENT_STREAM`` bytes"""
+    return any(int(m.group(1)) >= LARGE_CONTENT_STREAM for m in _STREAM_LENGTH.finditer(file_bytes))
+
+
+def _stored_length(doc: "pymupdf.Document", xref: int) -> int:
+    """Size of a stream as stored in the file, without decompressing it"""
+    kind, value = doc.xref_get_key(xref, "Length")
+    if kind == "int":
+        return int(value)
+    return len(doc.xref_stream_raw(xref) or b"")
+
+
+def _is_graphics_only(page: "pymupdf.Page") -> bool:
+    """
+    True if a page with large content streams cannot produce any text
+    
+    Diagram-heavy pages can carry megabytes of path operators whose interpretation
+    dominates extraction time. Text can only come from BT/ET blocks in the page's own
+    streams, form XObjects or annotations, so a page with none of those is skipped.
+    """
+    doc = page.parent
+    xrefs = page.get_contents()
+    if sum(_stored_length(doc, xref) for xref in xrefs) < LARGE_CONTENT_STREAM:
+        return False
+    if any(b"BT" in (doc.xref_stream(xref) or b"") for xref in xrefs):
+        return False
+    return not page.get_xobjects() and page.first_annot is None
+
+
+def _page_text(page: "pymupdf.Page", check_graphics: bool = True) -> str:
+    """Extract plain text from a PDF page, skipping graphics-only pages if ``check_graphics``"""
+    if check_graphics and _is_graphics_only(page):
+        return ""
+    return page.get_text("text", flags=PDF_TEXT_FLAGS)
+
+
+def _extract_pdf_pages(file_bytes: bytes, start: int, stop: int, check_graphics: bool = True) -> str:
+    """Extract text from pages [start, stop) of a PDF (runs in a worker process)"""
+    with pymupdf.open(stream=file_bytes, filetype="pdf") as doc:
+        return "".join(_page_text(doc[i], check_graphics) for i in range(start, stop))
 
 
 class FileExtractor:
     """Extract text from various file formats"""
     
+    def __init__(self, pdf_workers: Optional[int] = None):
+        """
+        Args:
+            pdf_workers: Processes a large PDF is split across (defaults to CPU count)
+        """
+        self.pdf_workers = pdf_workers or os.cpu_count() or 1
+    
+    def extract_from_pdf(self, source: FileSource) -> str:
+        """Extract text from PDF using PyMuPDF, falling back to PyPDF2"""
+        # MuPDF parses from memory, and worker processes need a picklable copy anyway
+        file_bytes = _as_bytes(source)
+        try:
+            with pymupdf.open(stream=file_bytes, filetype="pdf") as doc:
+                page_count = doc.page_count
+                # Already inside a worker process (e.g. the ingestion pool): don't nest pools
+                in_worker = multiprocessing.parent_process() is not None
+                # Only files holding a large stream can have pages worth checking
+                check_graphics = _has_large_stream(file_bytes)
+                if page_count <= PARALLEL_PDF_PAGE_THRESHOLD or in_worker:
+                    return "".join(_page_text(page, check_graphics) for page in doc)
+            return self._extract_from_pdf_parallel(file_bytes, page_count, check_graphics)
+        except Exception:
+            # Some malformed PDFs are rejected by MuPDF but still readable by PyPDF2
+            return FileExtractor._extract_from_pdf_pypdf2(file_bytes)
+    
+    def _extract_from_pdf_parallel(self, file_bytes: bytes, page_count: int, check_graphics: bool = True) -> str:
+        """Extract text from a large PDF by farming page ranges out to worker processes"""
+        step = max(1, -(-page_count // self.pdf_workers))
+        pool = _pdf_pool.get(self.pdf_workers)
+        try:
+            futures = [
+                pool.submit(
+                    _extract_pdf_pages, file_bytes, start, min(start + step, page_count), check_graphics
+                )
+                for start in range(0, page_count, step)
+            ]
+            # Futures are joined in submission order to preserve page order
+            return "".join(f.result() for f in futures)
+        except BrokenProcessPool:
+            # A worker died (e.g. MuPDF crashed on this file); this PDF falls back to PyPDF2
+            _pdf_pool.discard(pool)
+            raise
+    
     @staticmethod
-    def extract_from_pdf(file_bytes: bytes) -> str:
-        """Extract text from PDF"""
-        text = ""
-        pdf = PdfReader(io.BytesIO(file_bytes))
+    def _extract_from_pdf_pypdf2(file_bytes: bytes) -> str:
+        """Extract text from PDF with the pure-Python PyPDF2 reader"""
+        pdf = PdfReader(_as_stream(file_bytes))
+        parts = []
         for page in pdf.pages:
-            text += page.extract_text() or ""
-        return text
+            parts.append(page.extract_text() or "")
+        return "".join(parts)
     
     @staticmethod
-    def extract_from_docx(file_bytes: bytes) -> str:
+    def extract_from_docx(source: FileSource) -> str:
         """Extract text from DOCX"""
-        doc = Document(io.BytesIO(file_bytes))
+        doc = Document(_as_stream(source))
         return "\n".join([p.text for p in doc.paragraphs])
     
     @staticmethod
-    def extract_from_excel(file_bytes: bytes) -> str:
-        """Extract text from Excel"""
-        df = pd.read_excel(io.BytesIO(file_bytes))
-        text = ""
-        for i, row in df.iterrows():
-            row_text = " | ".join(f"{col}: {row[col]}" for col in df.columns)
-            text += f"Row {i+1}: {row_text}\n"
-        return text
+    def _read_excel(source: FileSource) -> pd.DataFrame:
+        """Read the first sheet with the Rust calamine engine, falling back to pandas' default"""
+        try:
+            return pd.read_excel(_as_stream(source), engine="calamine")
+        except Exception:
+            # calamine not installed or file not understood; default engine (openpyxl/xlrd)
+            return pd.read_excel(_as_stream(source))
     
     @staticmethod
-    def extract_from_zip(file_bytes: bytes) -> str:
+    def extract_from_excel(source: FileSource) -> str:
+        """Extract text from Excel"""
+        df = FileExtractor._read_excel(source)
+        if df.empty or len(df.columns) == 0:
+            return ""
+        
+        # Render cells as iterrows() + f-strings did: rows of an all-numeric sheet share one
+        # upcast dtype (vectorized), anything else is boxed so dates keep their time part
+        values = df.to_numpy()
+        if values.dtype.kind in "biuf":
+            cells = values.astype(str)
+        else:
+            cells = np.vectorize(str, otypes=[object])(df.astype(object).to_numpy())
+        
+        # Build each "col: value" column as a string Series, then join across columns
+        parts = [
+            f"{col}: " + pd.Series(cells[:, i], index=df.index, dtype=object)
+            for i, col in enumerate(df.columns)
+        ]
+        joined = parts[0]
+        if len(parts) > 1:
+            joined = joined.str.cat(parts[1:], sep=" | ")
+        rows = "Row " + (df.index + 1).astype(str) + ": " + joined
+        return "\n".join(rows.tolist()) + "\n"
+    
+    def extract_from_zip(self, source: FileSource) -> str:
         """Extract text from ZIP archive"""
-        text = ""
-        extractor = FileExtractor()
-        with zipfile.ZipFile(io.BytesIO(file_bytes)) as z:
+        parts = []
+        with zipfile.ZipFile(_as_stream(source)) as z:
             for filename in z.namelist():
                 with z.open(filename) as f:
                     inner = f.read()
-                    extracted, _ = extractor.extract(inner, filename)
-                    text += extracted + "\n\n"
-        return text
+                    extracted, _ = self.extract(inner, filename)
+                    parts.append(extracted + "\n\n")
+        return "".join(parts)
     
-    def extract(self, file_bytes: bytes, filename: str) -> Tuple[str, bool]:
+    def extract(self, source: FileSource, filename: str) -> Tuple[str, bool]:
         """
         Extract text from file based on extension
         
@@ -58,15 +210,15 @@ class FileExtractor:
         
         try:
             if filename.endswith(".pdf"):
-                return self.extract_from_pdf(file_bytes), True
+                return self.extract_from_pdf(source), True
             elif filename.endswith(".docx"):
-                return self.extract_from_docx(file_bytes), True
+                return self.extract_from_docx(source), True
             elif filename.endswith((".xlsx", ".xls")):
-                return self.extract_from_excel(file_bytes), True
+                return self.extract_from_excel(source), True
             elif filename.endswith(".zip"):
-                return self.extract_from_zip(file_bytes), True
+                return self.extract_from_zip(source), True
             else:
                 # Fallback: try UTF-8 decode
-                return file_bytes.decode("utf-8", errors="ignore"), True
+                return _as_bytes(source).decode("utf-8", errors="ignore"), True
         except Exception as e:
             return f"[Error extracting {filename}: {str(e)}]", False
\ No newline at end of file
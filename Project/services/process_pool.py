@@ -0,0 +1,42 @@
+# services/process_pool.py
+import multiprocessing
+import threading
+import concurrent.futures
+from typing import Optional
+
+
+def mp_context():
+    """Start pool workers without fork: the server process already runs threads"""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+class LazyProcessPool:
+    """Process pool created on first use and replaced once a worker dies"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+    def get(self, max_workers: int) -> concurrent.futures.ProcessPoolExecutor:
+        """Return the pool, creating it with ``max_workers`` processes if needed"""
+        with self._lock:
+            if self._pool is None:
+                self._pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=max_workers, mp_context=mp_context()
+                )
+            return self._pool
+
+    def discard(self, pool: concurrent.futures.ProcessPoolExecutor):
+        """Drop a broken pool so the next caller starts a fresh one"""
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self, wait: bool = True):
+        """Shut down the current pool, if any"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
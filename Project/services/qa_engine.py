@@ -1,7 +1,6 @@
 from typing import Optional, Tuple
 from langchain_openai import ChatOpenAI
 from langchain_community.vectorstores import FAISS
-from langchain_core.runnables import RunnablePassthrough
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import PromptTemplate
@@ -62,10 +61,10 @@ Answer:"""
         
         prompt = ChatPromptTemplate.from_template(template)
         
-        # Build LCEL chain
+        # Build LCEL chain; retrieval happens once in the wrapper and its documents are
+        # reused both as the prompt context and as source_documents
         chain = (
-            {"context": retriever, "question": RunnablePassthrough()}
-            | prompt
+            prompt
             | llm
             | StrOutputParser()
         )
@@ -78,10 +77,19 @@ Answer:"""
             
             def __call__(self, inputs):
                 query = inputs["query"]
-                # Get relevant documents for source_documents
-                docs = self.retriever.get_relevant_documents(query)
-                # Run the chain
-                result = self.chain.invoke(query)
+                docs = self.retriever.invoke(query)
+                result = self.chain.invoke({"context": docs, "question": query})
+                return {
+                    "query": query,
+                    "result": result,
+                    "source_documents": docs
+                }
+            
+            async def ainvoke(self, inputs):
+                """Async counterpart of __call__ so queries don't block the event loop"""
+                query = inputs["query"]
+                docs = await self.retriever.ainvoke(query)
+                result = await self.chain.ainvoke({"context": docs, "question": query})
                 return {
                     "query": query,
                     "result": result,
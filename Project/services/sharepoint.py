@@ -1,46 +1,156 @@
 # services/sharepoint.py
-import requests
+import asyncio
+import io
+import httpx
 import base64
-from typing import Dict, List, Any
-from functools import lru_cache
+from collections import deque
+from typing import Dict, List, Any, BinaryIO, Optional
 import time
+import tempfile
+import logging
+from cachetools import TLRUCache, TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Downloads larger than this spill from memory to a named temporary file on disk
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+# Throttled (429) and unavailable (503) Graph responses are retried, waiting as Retry-After says
+RETRY_STATUS_CODES = {429, 503}
+MAX_RETRIES = 5
+MAX_RETRY_DELAY = 120
+
+# Process-wide token cache keyed by (tenant_id, client_id); entries expire at the stored expiry time
+_token_cache = TLRUCache(maxsize=32, ttu=lambda _key, value, _now: value[1], timer=time.time)
 
 
 class SharePointClient:
-    """SharePoint Graph API client with caching"""
+    """SharePoint Graph API client with caching and a pooled async HTTP/2 connection"""
     
-    def __init__(self, tenant_id: str, client_id: str, client_secret: str):
+    def __init__(self, tenant_id: str, client_id: str, client_secret: str,
+                 max_connections: int = 100, max_keepalive_connections: int = 50,
+                 listing_cache_ttl: int = 300, redis_url: Optional[str] = None,
+                 max_concurrent_listings: int = 8):
         self.tenant_id = tenant_id
         self.client_id = client_id
         self.client_secret = client_secret
-        self._token = None
-        self._token_expiry = 0
+        self._token_key = (tenant_id, client_id)
+        self._token_lock = asyncio.Lock()
+        # Folder listings keyed by (drive_id, item_id, etag); a changed etag naturally misses
+        self._listing_cache = TTLCache(maxsize=1024, ttl=listing_cache_ttl)
+        # Bounds how many folders are listed at once, however wide a level of the tree is
+        self._listing_semaphore = asyncio.Semaphore(max_concurrent_listings)
+        self._redis = self._connect_redis(redis_url) if redis_url else None
+        self._client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections
+            ),
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            follow_redirects=True
+        )
     
-    def get_access_token(self) -> str:
-        """Get or refresh access token"""
-        if self._token and time.time() < self._token_expiry:
-            return self._token
-        
-        token_url = f"https://login.microsoftonline.com/{self.tenant_id}/oauth2/v2.0/token"
-        token_data = {
-            "grant_type": "client_credentials",
-            "client_id": self.client_id,
-            "client_secret": self.client_secret,
-            "scope": "https://graph.microsoft.com/.default"
-        }
+    @staticmethod
+    def _connect_redis(redis_url: str):
+        """Create a Redis client for sharing tokens across workers, if redis is installed"""
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            logger.warning("REDIS_URL is set but the redis package is not installed; using in-process token cache")
+            return None
+        return redis.from_url(redis_url)
+    
+    async def aclose(self):
+        """Close pooled connections"""
+        await self._client.aclose()
+        if self._redis is not None:
+            await self._redis.aclose()
+    
+    @property
+    def _redis_token_key(self) -> str:
+        return f"sharepoint:token:{self.tenant_id}:{self.client_id}"
+    
+    async def _get_cached_token(self) -> Optional[str]:
+        """Look up a valid token in the process cache, then in Redis"""
+        cached = _token_cache.get(self._token_key)
+        if cached:
+            return cached[0]
         
-        response = requests.post(token_url, data=token_data)
-        response.raise_for_status()
-        token_json = response.json()
+        if self._redis is not None:
+            try:
+                token = await self._redis.get(self._redis_token_key)
+                ttl = await self._redis.ttl(self._redis_token_key)
+            except Exception as e:
+                logger.warning(f"Redis token lookup failed: {e}")
+                return None
+            if token and ttl > 0:
+                token = token.decode("utf-8")
+                _token_cache[self._token_key] = (token, time.time() + ttl)
+                return token
         
-        self._token = token_json["access_token"]
-        self._token_expiry = time.time() + token_json.get("expires_in", 3600) - 300  # 5 min buffer
+        return None
+    
+    async def get_access_token(self) -> str:
+        """Get or refresh access token"""
+        token = await self._get_cached_token()
+        if token:
+            return token
         
-        return self._token
+        # Serialize refreshes so concurrent callers don't all hit the token endpoint
+        async with self._token_lock:
+            token = await self._get_cached_token()
+            if token:
+                return token
+            
+            token_url = f"https://login.microsoftonline.com/{self.tenant_id}/oauth2/v2.0/token"
+            token_data = {
+                "grant_type": "client_credentials",
+                "client_id": self.client_id,
+                "client_secret": self.client_secret,
+                "scope": "https://graph.microsoft.com/.default"
+            }
+            
+            response = await self._client.post(token_url, data=token_data)
+            response.raise_for_status()
+            token_json = response.json()
+            
+            token = token_json["access_token"]
+            ttl = max(token_json.get("expires_in", 3600) - 300, 1)  # 5 min buffer
+            _token_cache[self._token_key] = (token, time.time() + ttl)
+            
+            if self._redis is not None:
+                try:
+                    await self._redis.set(self._redis_token_key, token, ex=ttl)
+                except Exception as e:
+                    logger.warning(f"Redis token store failed: {e}")
+            
+            return token
+    
+    @staticmethod
+    def _retry_delay(response: httpx.Response, attempt: int) -> float:
+        """Seconds to wait before retrying: Retry-After if given, else exponential backoff"""
+        try:
+            delay = float(response.headers["Retry-After"])
+        except (KeyError, ValueError):
+            delay = 2 ** attempt
+        return min(max(delay, 0), MAX_RETRY_DELAY)
     
-    def share_link_to_drive_item(self, share_link: str) -> Dict[str, Any]:
+    async def _get(self, url: str, headers: Dict[str, str]) -> httpx.Response:
+        """GET a Graph URL, retrying throttled and unavailable responses"""
+        for attempt in range(MAX_RETRIES + 1):
+            response = await self._client.get(url, headers=headers)
+            if response.status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+                response.raise_for_status()
+                return response
+            delay = self._retry_delay(response, attempt)
+            logger.warning(f"Graph returned {response.status_code}, retrying in {delay:.0f}s")
+            await asyncio.sleep(delay)
+    
+    async def share_link_to_drive_item(self, share_link: str) -> Dict[str, Any]:
         """Convert SharePoint share link to drive item metadata"""
-        token = self.get_access_token()
+        token = await self.get_access_token()
         
         encoded_url = base64.urlsafe_b64encode(
             share_link.strip().encode("utf-8")
@@ -49,49 +159,105 @@ class SharePointClient:
         meta_url = f"https://graph.microsoft.com/v1.0/shares/u!{encoded_url}/driveItem"
         headers = {"Authorization": f"Bearer {token}"}
         
-        response = requests.get(meta_url, headers=headers)
-        response.raise_for_status()
+        response = await self._get(meta_url, headers)
         
         return response.json()
     
-    def list_children(self, drive_id: str, item_id: str) -> List[Dict[str, Any]]:
-        """List children of a folder item"""
-        token = self.get_access_token()
+    async def list_children(self, drive_id: str, item_id: str, etag: Optional[str] = None,
+                            refresh: bool = False) -> List[Dict[str, Any]]:
+        """
+        List children of a folder item, following @odata.nextLink pagination
+        
+        When the folder's etag is given the listing is cached for the configured TTL.
+        ``refresh`` skips the cached copy (the fresh listing is still cached).
+        """
+        cache_key = (drive_id, item_id, etag)
+        if etag and not refresh:
+            cached = self._listing_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        token = await self.get_access_token()
         url = f"https://graph.microsoft.com/v1.0/drives/{drive_id}/items/{item_id}/children"
         headers = {"Authorization": f"Bearer {token}"}
         
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
+        children = []
+        async with self._listing_semaphore:
+            while url:
+                response = await self._get(url, headers)
+                page = response.json()
+                children.extend(page.get("value", []))
+                url = page.get("@odata.nextLink")
         
-        return response.json().get("value", [])
+        if etag:
+            self._listing_cache[cache_key] = children
+        return children
+    
+    @staticmethod
+    def _file_entry(item: Dict[str, Any]) -> Dict[str, Any]:
+        """Build manifest entry for a file item"""
+        return {
+            "id": item.get("id"),
+            "name": item.get("name"),
+            "etag": item.get("eTag", "")[:32],
+            "size": item.get("size"),
+            "lastModifiedDateTime": item.get("lastModifiedDateTime"),
+            "downloadUrl": item.get("@microsoft.graph.downloadUrl"),
+        }
     
-    def collect_files_recursively(self, item_json: Dict[str, Any]) -> List[Dict[str, Any]]:
-        """Recursively collect all files from a folder structure"""
+    async def collect_files_recursively(self, item_json: Dict[str, Any], refresh: bool = False) -> List[Dict[str, Any]]:
+        """
+        Collect all files from a folder structure, listing each folder level in parallel
+        
+        Pass ``refresh=True`` when detecting changes: a folder's eTag does not reliably change
+        when a file deeper in the tree does, so cached listings can hide edits.
+        """
         results = []
+        pending = deque([item_json])
         
-        def _walk(item: Dict[str, Any]):
-            if "file" in item:
-                results.append({
-                    "id": item.get("id"),
-                    "name": item.get("name"),
-                    "etag": item.get("eTag", "")[:32],
-                    "size": item.get("size"),
-                    "lastModifiedDateTime": item.get("lastModifiedDateTime"),
-                    "downloadUrl": item.get("@microsoft.graph.downloadUrl"),
-                })
-            elif "folder" in item:
-                drive_id = item.get("parentReference", {}).get("driveId")
-                item_id = item.get("id")
-                if drive_id and item_id:
-                    children = self.list_children(drive_id, item_id)
-                    for child in children:
-                        _walk(child)
+        while pending:
+            # Drain the current level: files are recorded, folders are listed concurrently
+            folders = []
+            while pending:
+                item = pending.popleft()
+                if "file" in item:
+                    results.append(self._file_entry(item))
+                elif "folder" in item:
+                    drive_id = item.get("parentReference", {}).get("driveId")
+                    item_id = item.get("id")
+                    if drive_id and item_id:
+                        folders.append((drive_id, item_id, item.get("eTag")))
+            
+            if folders:
+                listings = await asyncio.gather(*[
+                    self.list_children(drive_id, item_id, etag, refresh=refresh)
+                    for drive_id, item_id, etag in folders
+                ])
+                for children in listings:
+                    pending.extend(children)
         
-        _walk(item_json)
         return results
     
-    def download_file(self, download_url: str) -> bytes:
-        """Download file content from SharePoint"""
-        response = requests.get(download_url)
-        response.raise_for_status()
-        return response.content
\ No newline at end of file
+    async def download_file(self, download_url: str) -> BinaryIO:
+        """
+        Stream file content from SharePoint into memory, or a temporary file if large
+        
+        Files up to ``SPOOL_MAX_SIZE`` come back as ``BytesIO``; larger ones as a named
+        temporary file (deleted on close) that other processes can open by ``.name``.
+        The returned file is rewound to the start; the caller is responsible for closing it.
+        """
+        tmp = io.BytesIO()
+        try:
+            async with self._client.stream("GET", download_url) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    if isinstance(tmp, io.BytesIO) and tmp.tell() + len(chunk) > SPOOL_MAX_SIZE:
+                        spilled = tempfile.NamedTemporaryFile(prefix="sharepoint-")
+                        spilled.write(tmp.getbuffer())
+                        tmp = spilled
+                    tmp.write(chunk)
+        except BaseException:
+            tmp.close()
+            raise
+        tmp.seek(0)
+        return tmp
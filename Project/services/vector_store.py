@@ -1,98 +1,579 @@
 # services/vector_store.py
 import os
-import json
-from typing import Optional, List
+import shutil
+import tempfile
+import uuid
+import orjson
+import asyncio
+import logging
+import threading
+import concurrent.futures
+import warnings
+from contextlib import aclosing, contextmanager
+import faiss
+import numpy as np
+from typing import AsyncGenerator, Optional, List, Dict, Tuple
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from diskcache import Cache
+from services.embedding_cache import CachedEmbeddings
 from datetime import datetime
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+
+def _chunk_ids(file_id: str, count: int) -> List[str]:
+    """Deterministic docstore ids for a file's chunks"""
+    return [f"{file_id}:{i}" for i in range(count)]
+
+
+# Cosine similarity: L2-normalized vectors ranked by inner product
+COSINE_KWARGS = {"distance_strategy": DistanceStrategy.MAX_INNER_PRODUCT, "normalize_L2": True}
+
+
+@contextmanager
+def _cosine_kwargs_allowed():
+    """LangChain warns about normalize_L2 with inner product, which is exactly cosine; silence it"""
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="Normalizing L2 is not applicable")
+        yield
+
+
+# Load indexes memory-mapped and read-only so server workers share the page cache
+MMAP_IO_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+# Saves go to <hub>/versions/<version>/; <hub>/CURRENT names the live one
+CURRENT_POINTER = "CURRENT"
+LEGACY_VERSION = "legacy"
+LEGACY_FILES = ("index.faiss", "index.pkl", "manifest.json")
+
+
+# Re-cluster an IVF index once its size halves or doubles, or its clusters grow this much more uneven
+IVF_RETRAIN_SIZE_RATIO = 2.0
+IVF_RETRAIN_IMBALANCE_RATIO = 1.5
+
+
+def _ivf_stats(index: faiss.IndexIVF) -> dict:
+    """Training baseline of an IVF index, kept in the manifest to detect drift"""
+    return {"trained_size": int(index.ntotal), "imbalance": float(index.invlists.imbalance_factor())}
+
+
+def _compact(vectorstore: FAISS) -> np.ndarray:
+    """Return the store's vectors in label order and renumber the docstore mapping to match"""
+    index = vectorstore.index
+    labels = np.array(sorted(vectorstore.index_to_docstore_id), dtype=np.int64)
+    if isinstance(index, faiss.IndexIVF):
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        vectors = index.reconstruct_batch(labels) if len(labels) else np.empty((0, index.d), dtype=np.float32)
+    else:
+        vectors = index.reconstruct_n(0, index.ntotal)
+    vectorstore.index_to_docstore_id = {
+        i: vectorstore.index_to_docstore_id[int(label)] for i, label in enumerate(labels)
+    }
+    return vectors
+
 
 class VectorStoreManager:
     """Manage FAISS vector stores for hubs"""
     
     def __init__(self, persist_dir: str, openai_api_key: str, openai_api_base: str,
-                 embedding_model: str, chunk_size: int, chunk_overlap: int):
+                 embedding_model: str, chunk_size: int, chunk_overlap: int,
+                 ivf_min_vectors: int = 100_000, ivf_nprobe: int = 16, fp16_vectors: bool = True,
+                 embedding_batch_size: int = 512, embedding_concurrency: int = 8,
+                 embedding_cache: bool = True, embedding_cache_size_limit: int = 2 * 1024 ** 3):
         self.persist_dir = persist_dir
         self.openai_api_key = openai_api_key
         self.openai_api_base = openai_api_base
         self.embedding_model = embedding_model
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.ivf_min_vectors = ivf_min_vectors
+        self.ivf_nprobe = ivf_nprobe
+        self.fp16_vectors = fp16_vectors
+        self.embedding_batch_size = embedding_batch_size
+        self.embedding_concurrency = embedding_concurrency
+        self.embedding_cache = embedding_cache
+        self.embedding_cache_size_limit = embedding_cache_size_limit
+        self._embedding_cache = None
+        # Single writer thread: saves leave the request path but stay ordered per process
+        self._save_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="vectorstore-save"
+        )
+        self._pending_saves: Dict[str, concurrent.futures.Future] = {}
+        self._pending_lock = threading.Lock()
         os.makedirs(persist_dir, exist_ok=True)
     
     def _get_embeddings(self):
-        """Get OpenAI embeddings instance"""
-        return OpenAIEmbeddings(
+        """Get OpenAI embeddings instance, wrapped in the on-disk chunk cache if enabled"""
+        embeddings = OpenAIEmbeddings(
             openai_api_key=self.openai_api_key,
             base_url=self.openai_api_base,
             model=self.embedding_model
         )
+        if not self.embedding_cache:
+            return embeddings
+        
+        # Opened lazily so each server worker gets its own SQLite connection
+        if self._embedding_cache is None:
+            self._embedding_cache = Cache(
+                os.path.join(self.persist_dir, ".embed_cache"),
+                size_limit=self.embedding_cache_size_limit,
+                eviction_policy="least-recently-used"
+            )
+        return CachedEmbeddings(embeddings, self._embedding_cache, namespace=self.embedding_model)
+    
+    def _flat_index(self, dimension: int, metric: int) -> faiss.Index:
+        """Exhaustive index; float16 storage with ``fp16_vectors``"""
+        if self.fp16_vectors:
+            return faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_fp16, metric)
+        return faiss.IndexFlat(dimension, metric)
     
-    def create_vectorstore(self, text: str, hub_name: str) -> FAISS:
-        """Create and persist vector store from text"""
-        # Split text into chunks
+    def _ivf_drifted(self, index: faiss.IndexIVF, stats: dict) -> bool:
+        """Whether an IVF index has changed enough since training to re-cluster it"""
+        n, trained = index.ntotal, stats["trained_size"]
+        if n * IVF_RETRAIN_SIZE_RATIO < trained or n > trained * IVF_RETRAIN_SIZE_RATIO:
+            return True
+        return index.invlists.imbalance_factor() > stats["imbalance"] * IVF_RETRAIN_IMBALANCE_RATIO
+    
+    def _optimize_index(self, vectorstore: FAISS, ivf_stats: Optional[dict] = None) -> Optional[dict]:
+        """
+        Pick a flat or IVF index for the store's size, re-clustering a drifted IVF index
+        
+        Args:
+            ivf_stats: IVF training baseline saved with the hub
+        
+        Returns:
+            The IVF training baseline to save with the hub, or None for a flat index
+        """
+        index = vectorstore.index
+        if isinstance(index, faiss.IndexIVF):
+            ivf_stats = ivf_stats or _ivf_stats(index)
+            if not self._ivf_drifted(index, ivf_stats):
+                return ivf_stats
+            logger.info(f"Re-clustering IVF index ({ivf_stats['trained_size']} -> {index.ntotal} vectors)")
+            vectors = _compact(vectorstore)
+            if index.ntotal < self.ivf_min_vectors:
+                flat = self._flat_index(index.d, index.metric_type)
+                flat.add(vectors)
+                vectorstore.index = flat
+                return None
+        elif index.ntotal < self.ivf_min_vectors:
+            if self.fp16_vectors and isinstance(index, faiss.IndexFlat):
+                sq = self._flat_index(index.d, index.metric_type)
+                sq.add(index.reconstruct_n(0, index.ntotal))
+                vectorstore.index = sq
+            return None
+        else:
+            vectors = index.reconstruct_n(0, index.ntotal)
+        nlist = int(4 * np.sqrt(index.ntotal))
+        
+        # k-means gains little beyond ~256 points per centroid
+        train = vectors
+        max_train = 256 * nlist
+        if len(vectors) > max_train:
+            rng = np.random.default_rng(0)
+            train = vectors[rng.choice(len(vectors), max_train, replace=False)]
+        
+        quantizer = faiss.IndexFlat(index.d, index.metric_type)
+        if self.fp16_vectors:
+            ivf = faiss.IndexIVFScalarQuantizer(
+                quantizer, index.d, nlist, faiss.ScalarQuantizer.QT_fp16, index.metric_type
+            )
+        else:
+            ivf = faiss.IndexIVFFlat(quantizer, index.d, nlist, index.metric_type)
+        ivf.train(train)
+        ivf.add(vectors)
+        ivf.nprobe = self.ivf_nprobe
+        vectorstore.index = ivf
+        return _ivf_stats(ivf)
+    
+    def _empty_vectorstore(self, embeddings, dimension: int) -> FAISS:
+        """Empty cosine store; with ``fp16_vectors`` vectors go straight into float16 storage"""
+        index = self._flat_index(dimension, faiss.METRIC_INNER_PRODUCT)
+        with _cosine_kwargs_allowed():
+            return FAISS(embeddings, index, InMemoryDocstore(), {}, **COSINE_KWARGS)
+    
+    async def _add_files(self, vectorstore: Optional[FAISS], embeddings,
+                         texts: AsyncGenerator[Tuple[dict, str], None],
+                         stale_ids: Optional[Dict[str, List[str]]] = None) -> Tuple[Optional[FAISS], Dict[str, dict]]:
+        """
+        Split, embed and add files to the store as their texts arrive
+        
+        Args:
+            vectorstore: Store to add to, or None to create one from the first batch
+            stale_ids: Old chunk ids per file id, removed before the file's new chunks are added
+        
+        Returns:
+            The store (None if no chunks were produced) and each read file's entry with its ``chunk_count``
+        """
         splitter = RecursiveCharacterTextSplitter(
             chunk_size=self.chunk_size,
             chunk_overlap=self.chunk_overlap
         )
-        chunks = splitter.split_text(text)
+        stale_ids = stale_ids or {}
+        semaphore = asyncio.Semaphore(self.embedding_concurrency)
+        # Index edits are serialized; the edits themselves run in worker threads
+        index_lock = asyncio.Lock()
+        pending_stale: Dict[str, List[str]] = {}
+        processed: Dict[str, dict] = {}
+        tasks = []
+        chunks, metadatas, ids, file_ids = [], [], [], []
         
-        # Create FAISS index
+        async def _embed_and_add(batch_chunks, batch_metadatas, batch_ids, batch_file_ids):
+            nonlocal vectorstore
+            try:
+                vectors = await embeddings.aembed_documents(batch_chunks)
+                async with index_lock:
+                    if vectorstore is None:
+                        vectorstore = self._empty_vectorstore(embeddings, len(vectors[0]))
+                    remove = [i for f in dict.fromkeys(batch_file_ids) for i in pending_stale.pop(f, [])]
+                    await asyncio.to_thread(
+                        self._replace_chunks, vectorstore, remove,
+                        batch_chunks, vectors, batch_metadatas, batch_ids
+                    )
+            finally:
+                semaphore.release()
+        
+        async def _flush(size: int):
+            nonlocal chunks, metadatas, ids, file_ids
+            await semaphore.acquire()
+            # Surface a failed batch (e.g. the embedding API is down) before reading more texts
+            for task in [t for t in tasks if t.done()]:
+                tasks.remove(task)
+                task.result()
+            batch = (chunks[:size], metadatas[:size], ids[:size], file_ids[:size])
+            chunks, metadatas, ids, file_ids = chunks[size:], metadatas[size:], ids[size:], file_ids[size:]
+            tasks.append(asyncio.create_task(_embed_and_add(*batch)))
+        
+        try:
+            # Close the stream even when stopping early, so its downloads and extraction stop
+            async with aclosing(texts):
+                async for file_info, text in texts:
+                    file_id = file_info["id"]
+                    file_chunks = await asyncio.to_thread(splitter.split_text, text)
+                    del text
+                    processed[file_id] = dict(file_info, chunk_count=len(file_chunks))
+                    pending_stale[file_id] = stale_ids.get(file_id, [])
+                    
+                    chunks.extend(file_chunks)
+                    metadatas.extend({"source": file_info.get("name"), "file_id": file_id} for _ in file_chunks)
+                    ids.extend(_chunk_ids(file_id, len(file_chunks)))
+                    file_ids.extend(file_id for _ in file_chunks)
+                    while len(chunks) >= self.embedding_batch_size:
+                        await _flush(self.embedding_batch_size)
+            if chunks:
+                await _flush(len(chunks))
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        
+        # Files that produced no chunks still drop their old ones
+        remaining = [i for file_stale in pending_stale.values() for i in file_stale]
+        if vectorstore is not None and remaining:
+            await asyncio.to_thread(self._remove_chunks, vectorstore, remaining)
+        return vectorstore, processed
+    
+    async def create_vectorstore(self, hub_name: str, files: List[dict],
+                                 texts: AsyncGenerator[Tuple[dict, str], None]) -> Optional[FAISS]:
+        """
+        Create and persist vector store from a stream of extracted texts
+        
+        Args:
+            files: File metadata dicts, in manifest order
+            texts: (file_info, text) pairs as files are extracted
+        
+        Returns:
+            The new store, or None if no text could be extracted (nothing is saved)
+        """
         embeddings = self._get_embeddings()
-        vectorstore = FAISS.from_texts(chunks, embeddings)
+        vectorstore, processed = await self._add_files(None, embeddings, texts)
+        if vectorstore is None:
+            return None
+        ivf_stats = await asyncio.to_thread(self._optimize_index, vectorstore)
         
-        # Persist to disk
-        self.save_vectorstore(vectorstore, hub_name)
+        # Persist index and manifest (with each file's chunk_count) on the writer thread
+        manifest_files = [processed[f["id"]] for f in files if f["id"] in processed]
+        await self._save(vectorstore, hub_name, manifest_files, ivf_stats)
         
         return vectorstore
     
-    def save_vectorstore(self, vectorstore: FAISS, hub_name: str):
-        """Save vector store to disk"""
-        target_dir = os.path.join(self.persist_dir, hub_name)
-        os.makedirs(target_dir, exist_ok=True)
-        vectorstore.save_local(target_dir)
+    def _replace_chunks(self, vectorstore: FAISS, stale_ids: List[str], chunks: List[str],
+                        vectors: List[List[float]], metadatas: List[dict], ids: List[str]):
+        """Remove stale chunks, then add embedded ones"""
+        self._remove_chunks(vectorstore, stale_ids)
+        if not isinstance(vectorstore.index, faiss.IndexIVF):
+            vectorstore.add_embeddings(list(zip(chunks, vectors)), metadatas=metadatas, ids=ids)
+            return
+        
+        # IVF labels stay sparse after removals, so label new vectors past the highest one
+        array = np.array(vectors, dtype=np.float32)
+        if vectorstore._normalize_L2:
+            faiss.normalize_L2(array)
+        start = max(vectorstore.index_to_docstore_id, default=-1) + 1
+        labels = np.arange(start, start + len(ids), dtype=np.int64)
+        vectorstore.index.add_with_ids(array, labels)
+        vectorstore.docstore.add({
+            doc_id: Document(id=doc_id, page_content=chunk, metadata=metadata)
+            for doc_id, chunk, metadata in zip(ids, chunks, metadatas)
+        })
+        vectorstore.index_to_docstore_id.update(zip(labels.tolist(), ids))
     
-    def load_vectorstore(self, hub_name: str) -> Optional[FAISS]:
-        """Load vector store from disk"""
-        target_dir = os.path.join(self.persist_dir, hub_name)
-        if not os.path.isdir(target_dir):
+    @staticmethod
+    def _remove_chunks(vectorstore: FAISS, ids: List[str]):
+        """Remove chunks by docstore id, skipping ids the store doesn't have"""
+        if not isinstance(vectorstore.index, faiss.IndexIVF):
+            existing_ids = set(vectorstore.index_to_docstore_id.values())
+            ids = [i for i in ids if i in existing_ids]
+            if ids:
+                vectorstore.delete(ids)
+            return
+        
+        # LangChain's delete assumes flat-index labels; drop IVF vectors by label instead
+        wanted = set(ids)
+        labels = [label for label, doc_id in vectorstore.index_to_docstore_id.items() if doc_id in wanted]
+        if not labels:
+            return
+        vectorstore.index.remove_ids(np.array(labels, dtype=np.int64))
+        vectorstore.docstore.delete([vectorstore.index_to_docstore_id[label] for label in labels])
+        for label in labels:
+            del vectorstore.index_to_docstore_id[label]
+    
+    @staticmethod
+    def _supports_incremental(manifest: Optional[dict]) -> bool:
+        """Incremental updates need a saved version whose manifest has per-file chunk counts"""
+        if not manifest:
+            return False
+        return all("chunk_count" in f for f in manifest.get("files", []))
+    
+    async def changed_files(self, hub_name: str, files: List[dict]) -> List[dict]:
+        """Return the files that need (re)embedding: new, changed, or all if the hub can't be updated incrementally"""
+        await self.wait_for_save_async(hub_name)
+        manifest = self.load_manifest(hub_name)
+        if not self._supports_incremental(manifest):
+            return list(files)
+        
+        old_map = manifest.get("map", {})
+        return [f for f in files if old_map.get(f["id"]) != f["etag"]]
+    
+    async def update_vectorstore(self, hub_name: str, files: List[dict],
+                                 texts: AsyncGenerator[Tuple[dict, str], None]) -> Optional[FAISS]:
+        """Update a hub's vector store in place, embedding the files streamed in ``texts``"""
+        await self.wait_for_save_async(hub_name)
+        manifest = self.load_manifest(hub_name)
+        vectorstore = None
+        if self._supports_incremental(manifest):
+            # Editing needs a private in-memory copy; a memory-mapped index is read-only
+            vectorstore = await asyncio.to_thread(self.load_vectorstore, hub_name, False)
+        if vectorstore is None:
+            return await self.create_vectorstore(hub_name, files, texts)
+        
+        old_files = {f["id"]: f for f in manifest.get("files", [])}
+        current_ids = {f["id"] for f in files}
+        stale_ids = {file_id: _chunk_ids(file_id, old["chunk_count"]) for file_id, old in old_files.items()}
+        
+        # Drop chunks of files that no longer exist, then stream in the changed ones
+        removed_ids = [i for file_id in old_files if file_id not in current_ids for i in stale_ids[file_id]]
+        await asyncio.to_thread(self._remove_chunks, vectorstore, removed_ids)
+        vectorstore, processed = await self._add_files(vectorstore, vectorstore.embeddings, texts, stale_ids)
+        
+        # Nothing removed and every changed file failed: the saved hub is still current
+        if not removed_ids and not processed:
+            return vectorstore
+        
+        # Unchanged files keep their previous chunk counts; failed files keep their old entry
+        manifest_files = []
+        for f in files:
+            old = old_files.get(f["id"])
+            if f["id"] in processed:
+                manifest_files.append(processed[f["id"]])
+            elif old is not None and old.get("etag") == f["etag"]:
+                manifest_files.append(dict(f, chunk_count=old["chunk_count"]))
+            elif old is not None:
+                manifest_files.append(old)
+        
+        ivf_stats = await asyncio.to_thread(self._optimize_index, vectorstore, manifest.get("ivf"))
+        await self._save(vectorstore, hub_name, manifest_files, ivf_stats)
+        
+        return vectorstore
+    
+    def _hub_dir(self, hub_name: str) -> str:
+        return os.path.join(self.persist_dir, hub_name)
+    
+    def _version_dir(self, hub_name: str, version: str) -> str:
+        if version == LEGACY_VERSION:
+            return self._hub_dir(hub_name)
+        return os.path.join(self._hub_dir(hub_name), "versions", version)
+    
+    def current_version(self, hub_name: str) -> Optional[str]:
+        """Version stamp of the hub's saved index, or None if the hub has none"""
+        hub_dir = self._hub_dir(hub_name)
+        try:
+            with open(os.path.join(hub_dir, CURRENT_POINTER), "r", encoding="utf-8") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            if os.path.exists(os.path.join(hub_dir, "index.faiss")):
+                return LEGACY_VERSION
             return None
+    
+    def save_vectorstore(self, vectorstore: FAISS, hub_name: str, files: List[dict],
+                         ivf_stats: Optional[dict] = None) -> str:
+        """Save vector store and its file manifest to disk as a new hub version; returns the version stamp"""
+        hub_dir = self._hub_dir(hub_name)
+        versions_dir = os.path.join(hub_dir, "versions")
+        os.makedirs(versions_dir, exist_ok=True)
+        previous = self.current_version(hub_name)
+        
+        scratch_dir = tempfile.mkdtemp(prefix=".save-", dir=versions_dir)
+        try:
+            vectorstore.save_local(scratch_dir)
+            self._write_manifest(scratch_dir, files, ivf_stats)
+            # Named once written so versions sort by completion
+            version = f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+            os.rename(scratch_dir, os.path.join(versions_dir, version))
+        except BaseException:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+            raise
+        
+        fd, pointer_tmp = tempfile.mkstemp(prefix=".current-", dir=hub_dir)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(pointer_tmp, os.path.join(hub_dir, CURRENT_POINTER))
         
+        self._prune_versions(hub_name, previous if previous not in (None, LEGACY_VERSION) else version)
+        return version
+    
+    def _prune_versions(self, hub_name: str, oldest_kept: str):
+        """Remove hub versions older than ``oldest_kept`` and any pre-versioning files"""
+        hub_dir = self._hub_dir(hub_name)
+        for name in LEGACY_FILES:
+            try:
+                os.remove(os.path.join(hub_dir, name))
+            except FileNotFoundError:
+                pass
+        versions_dir = os.path.join(hub_dir, "versions")
+        for name in os.listdir(versions_dir):
+            if not name.startswith(".") and name < oldest_kept:
+                shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
+    
+    def save_vectorstore_in_background(self, vectorstore: FAISS, hub_name: str, files: List[dict],
+                                       ivf_stats: Optional[dict] = None) -> concurrent.futures.Future:
+        """Save vector store and manifest on the writer thread; the future resolves to the version stamp"""
+        os.makedirs(self._hub_dir(hub_name), exist_ok=True)
+        future = self._save_executor.submit(self.save_vectorstore, vectorstore, hub_name, files, ivf_stats)
+        with self._pending_lock:
+            self._pending_saves[hub_name] = future
+        
+        def _done(f: concurrent.futures.Future):
+            with self._pending_lock:
+                if self._pending_saves.get(hub_name) is f:
+                    del self._pending_saves[hub_name]
+            if f.exception():
+                logger.error(f"Failed to save vector store for hub '{hub_name}': {f.exception()}")
+        
+        future.add_done_callback(_done)
+        return future
+    
+    async def _save(self, vectorstore: FAISS, hub_name: str, files: List[dict],
+                    ivf_stats: Optional[dict] = None) -> str:
+        """Save on the writer thread without blocking the event loop; raises if the save fails"""
+        return await asyncio.wrap_future(self.save_vectorstore_in_background(vectorstore, hub_name, files, ivf_stats))
+    
+    def _pending_save(self, hub_name: str) -> Optional[concurrent.futures.Future]:
+        with self._pending_lock:
+            return self._pending_saves.get(hub_name)
+    
+    def wait_for_save(self, hub_name: str):
+        """Block until any pending background save of the hub has finished (off the event loop only)"""
+        future = self._pending_save(hub_name)
+        if future is not None:
+            concurrent.futures.wait([future])
+    
+    async def wait_for_save_async(self, hub_name: str):
+        """Wait for any pending background save of the hub without blocking the event loop"""
+        future = self._pending_save(hub_name)
+        if future is not None:
+            await asyncio.to_thread(concurrent.futures.wait, [future])
+    
+    def close(self):
+        """Flush pending background saves"""
+        self._save_executor.shutdown(wait=True)
+    
+    def load_vectorstore(self, hub_name: str, mmap: bool = True) -> Optional[FAISS]:
+        """Load vector store from disk, memory-mapped read-only unless ``mmap=False``"""
+        return self.load_vectorstore_with_version(hub_name, mmap)[0]
+    
+    def load_vectorstore_with_version(self, hub_name: str,
+                                      mmap: bool = True) -> Tuple[Optional[FAISS], Optional[str]]:
+        """Load the current vector store (see ``load_vectorstore``) and the version it came from"""
+        self.wait_for_save(hub_name)
+        for attempt in range(2):
+            version = self.current_version(hub_name)
+            if version is None:
+                return None, None
+            try:
+                return self._load_version(hub_name, version, mmap), version
+            except (FileNotFoundError, RuntimeError):
+                # Another process pruned this version between reading the pointer and the files
+                if attempt or self.current_version(hub_name) == version:
+                    raise
+    
+    def _load_version(self, hub_name: str, version: str, mmap: bool) -> FAISS:
         embeddings = self._get_embeddings()
-        return FAISS.load_local(
-            target_dir,
+        vectorstore = FAISS.load_local(
+            self._version_dir(hub_name, version),
             embeddings,
-            allow_dangerous_deserialization=True
+            allow_dangerous_deserialization=True,
+            io_flags=MMAP_IO_FLAGS if mmap else 0
         )
-    
-    def save_manifest(self, hub_name: str, files: List[dict]):
-        """Save file manifest for a hub"""
-        target_dir = os.path.join(self.persist_dir, hub_name)
-        os.makedirs(target_dir, exist_ok=True)
         
+        # Search settings aren't persisted; hubs built before cosine search keep L2
+        if vectorstore.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            with _cosine_kwargs_allowed():
+                vectorstore = FAISS(
+                    embeddings, vectorstore.index, vectorstore.docstore,
+                    vectorstore.index_to_docstore_id, **COSINE_KWARGS
+                )
+        return vectorstore
+    
+    @staticmethod
+    def _write_manifest(target_dir: str, files: List[dict], ivf_stats: Optional[dict] = None):
+        """Write a file manifest, with the IVF training baseline if the index is IVF"""
         manifest = {
             "files": files,
             "map": {f["id"]: f["etag"] for f in files},
             "count": len(files),
             "created_at": datetime.utcnow().isoformat()
         }
+        if ivf_stats is not None:
+            manifest["ivf"] = ivf_stats
         
+        # Manifests can list thousands of files and aren't hand-edited, so skip indentation
         manifest_path = os.path.join(target_dir, "manifest.json")
-        with open(manifest_path, "w") as f:
-            json.dump(manifest, f, indent=2)
+        with open(manifest_path, "wb") as f:
+            f.write(orjson.dumps(manifest, option=orjson.OPT_SERIALIZE_NUMPY))
     
     def load_manifest(self, hub_name: str) -> Optional[dict]:
-        """Load file manifest for a hub"""
-        manifest_path = os.path.join(self.persist_dir, hub_name, "manifest.json")
-        if not os.path.exists(manifest_path):
+        """Load the file manifest of the hub's current version"""
+        version = self.current_version(hub_name)
+        if version is None:
+            return None
+        manifest_path = os.path.join(self._version_dir(hub_name, version), "manifest.json")
+        try:
+            with open(manifest_path, "rb") as f:
+                return orjson.loads(f.read())
+        except FileNotFoundError:
             return None
-        
-        with open(manifest_path, "r") as f:
-            return json.load(f)
     
     def save_metadata(self, hub_name: str, metadata: dict):
         """Save hub metadata (SharePoint link, sync settings, etc.)"""
@@ -100,8 +581,8 @@ class VectorStoreManager:
         os.makedirs(target_dir, exist_ok=True)
         
         metadata_path = os.path.join(target_dir, "metadata.json")
-        with open(metadata_path, "w") as f:
-            json.dump(metadata, f, indent=2)
+        with open(metadata_path, "wb") as f:
+            f.write(orjson.dumps(metadata, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
     
     def load_metadata(self, hub_name: str) -> Optional[dict]:
         """Load hub metadata"""
@@ -109,8 +590,8 @@ class VectorStoreManager:
         if not os.path.exists(metadata_path):
             return None
         
-        with open(metadata_path, "r") as f:
-            return json.load(f)
+        with open(metadata_path, "rb") as f:
+            return orjson.loads(f.read())
     
     def list_hubs(self) -> List[str]:
         """List all available hubs"""
@@ -119,12 +600,12 @@ class VectorStoreManager:
         
         return [
             d for d in os.listdir(self.persist_dir)
-            if os.path.isdir(os.path.join(self.persist_dir, d))
+            if os.path.isdir(os.path.join(self.persist_dir, d)) and not d.startswith(".")
         ]
     
     def delete_hub(self, hub_name: str):
         """Delete a hub and all its data"""
-        import shutil
+        self.wait_for_save(hub_name)
         target_dir = os.path.join(self.persist_dir, hub_name)
         if os.path.exists(target_dir):
             shutil.rmtree(target_dir)
\ No newline at end of file
@@ -23,9 +23,29 @@ class Settings(BaseSettings):
     CHUNK_SIZE: int = 1000
     CHUNK_OVERLAP: int = 100
     
+    # Vector Index
+    IVF_MIN_VECTORS: int = 100000  # Hubs with at least this many chunks use an IVF index
+    IVF_NPROBE: int = 16  # IVF clusters scanned per query
+    FP16_VECTORS: bool = True  # Store index vectors as float16 to halve memory
+    
+    # Embeddings
+    EMBEDDING_BATCH_SIZE: int = 512  # Chunks per embedding request
+    EMBEDDING_CONCURRENCY: int = 8  # Embedding requests in flight at once
+    EMBEDDING_CACHE: bool = True  # Reuse vectors of previously embedded chunks (stored under PERSIST_DIR)
+    EMBEDDING_CACHE_SIZE_LIMIT: int = 2 * 1024 ** 3  # Bytes on disk before least recently used vectors are evicted
+    
     # Parallel Processing
     MAX_WORKERS: int = 10
     BATCH_SIZE: int = 20
+    EXTRACT_WORKERS: Optional[int] = None  # Extraction processes (defaults to this worker's CPU share)
+    WEB_CONCURRENCY: int = 1  # Server worker processes; CPU-bound pools get CPU count / this each
+    
+    # SharePoint caching
+    GRAPH_CACHE_TTL: int = 300  # Seconds to cache folder listings
+    REDIS_URL: Optional[str] = None  # Share access tokens across workers (requires redis package)
+    
+    # Hubs kept in memory at once (least recently used are unloaded)
+    MAX_LOADED_HUBS: int = 10
     
     # QA Engine
     RETRIEVER_K: int = 6
@@ -2,7 +2,9 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+import asyncio
 import logging
+import os
 import time
 from datetime import datetime
 
@@ -26,10 +28,15 @@ settings = get_settings()
 sharepoint_client = SharePointClient(
     tenant_id=settings.TENANT_ID,
     client_id=settings.CLIENT_ID,
-    client_secret=settings.CLIENT_SECRET
+    client_secret=settings.CLIENT_SECRET,
+    listing_cache_ttl=settings.GRAPH_CACHE_TTL,
+    redis_url=settings.REDIS_URL
 )
 
-file_extractor = FileExtractor()
+# Every server worker has its own extraction pools, so each sizes them to its share of the CPUs
+cpu_share = max(1, (os.cpu_count() or 1) // settings.WEB_CONCURRENCY)
+
+file_extractor = FileExtractor(pdf_workers=cpu_share)
 
 vector_store_manager = VectorStoreManager(
     persist_dir=settings.PERSIST_DIR,
@@ -37,7 +44,14 @@ vector_store_manager = VectorStoreManager(
     openai_api_base=settings.OPENAI_API_BASE,
     embedding_model=settings.OPENAI_EMBEDDING_MODEL,
     chunk_size=settings.CHUNK_SIZE,
-    chunk_overlap=settings.CHUNK_OVERLAP
+    chunk_overlap=settings.CHUNK_OVERLAP,
+    ivf_min_vectors=settings.IVF_MIN_VECTORS,
+    ivf_nprobe=settings.IVF_NPROBE,
+    fp16_vectors=settings.FP16_VECTORS,
+    embedding_batch_size=settings.EMBEDDING_BATCH_SIZE,
+    embedding_concurrency=settings.EMBEDDING_CONCURRENCY,
+    embedding_cache=settings.EMBEDDING_CACHE,
+    embedding_cache_size_limit=settings.EMBEDDING_CACHE_SIZE_LIMIT
 )
 
 qa_engine_builder = QAEngineBuilder(
@@ -50,7 +64,8 @@ qa_engine_builder = QAEngineBuilder(
 
 parallel_processor = ParallelProcessor(
     max_workers=settings.MAX_WORKERS,
-    batch_size=settings.BATCH_SIZE
+    batch_size=settings.BATCH_SIZE,
+    extract_workers=settings.EXTRACT_WORKERS or cpu_share
 )
 
 
@@ -63,6 +78,9 @@ async def lifespan(app: FastAPI):
     # Shutdown
     logger.info("Shutting down Intelligent Assistant API")
     app_state.clear_all()
+    await sharepoint_client.aclose()
+    vector_store_manager.close()
+    parallel_processor.close()
 
 
 # Initialize FastAPI app
@@ -186,34 +204,32 @@ async def ingest_from_sharepoint(
         logger.info(f"Starting SharePoint ingestion for hub: {request.hub_name}")
         
         # 1. Get SharePoint item metadata
-        item_json = sharepoint_client.share_link_to_drive_item(request.sharepoint_link)
+        item_json = await sharepoint_client.share_link_to_drive_item(request.sharepoint_link)
         
         # 2. Collect all files recursively
         logger.info("Collecting files from SharePoint...")
-        files = sharepoint_client.collect_files_recursively(item_json)
+        files = await sharepoint_client.collect_files_recursively(item_json)
         
         if not files:
             raise HTTPException(status_code=400, detail="No files found in SharePoint link")
         
         logger.info(f"Found {len(files)} files to process")
         
-        # 3. Process files in parallel
-        logger.info("Processing files in parallel...")
-        all_text = parallel_processor.process_files_parallel(
+        # 3. Process files in parallel, streaming each text into the vector store as it's extracted
+        logger.info("Processing files in parallel and creating vector store...")
+        texts = parallel_processor.stream_files_parallel(
             files=files,
             download_func=sharepoint_client.download_file,
             extract_func=file_extractor.extract
         )
         
-        if not all_text.strip():
-            raise HTTPException(status_code=400, detail="No text could be extracted from files")
+        # 4. Create vector store (saved together with its file manifest)
+        vectorstore = await vector_store_manager.create_vectorstore(request.hub_name, files, texts)
         
-        # 4. Create vector store
-        logger.info("Creating vector store...")
-        vectorstore = vector_store_manager.create_vectorstore(all_text, request.hub_name)
+        if vectorstore is None:
+            raise HTTPException(status_code=400, detail="No text could be extracted from files")
         
-        # 5. Save manifest and metadata
-        vector_store_manager.save_manifest(request.hub_name, files)
+        # 5. Save metadata
         vector_store_manager.save_metadata(request.hub_name, {
             "sharepoint_link": request.sharepoint_link,
             "auto_sync": request.auto_sync,
@@ -258,37 +274,37 @@ async def ingest_from_upload(
         if not files:
             raise HTTPException(status_code=400, detail="No files uploaded")
         
-        # Process files in parallel
-        all_text = []
+        # Extract files one at a time, streaming each text into the vector store
         file_metadata = []
         
-        async def process_uploaded_file(file: UploadFile):
-            content = await file.read()
-            text, success = file_extractor.extract(content, file.filename)
-            if success:
-                all_text.append(text)
-                file_metadata.append({
-                    "id": file.filename,
-                    "name": file.filename,
-                    "etag": str(hash(content))[:32],
-                    "size": len(content),
-                    "lastModifiedDateTime": datetime.utcnow().isoformat()
-                })
-        
-        # Process all files
-        import asyncio
-        await asyncio.gather(*[process_uploaded_file(f) for f in files])
-        
-        combined_text = "\n\n".join(all_text)
-        if not combined_text.strip():
-            raise HTTPException(status_code=400, detail="No text could be extracted from uploaded files")
-        
-        # Create vector store
+        async def extract_uploaded_files():
+            seen_names = set()
+            for position, file in enumerate(files):
+                # Chunk ids derive from file ids, so uploads sharing a filename need distinct ids
+                file_id = file.filename if file.filename not in seen_names else f"{file.filename}#{position}"
+                seen_names.add(file.filename)
+                content = await file.read()
+                text, success = await asyncio.to_thread(file_extractor.extract, content, file.filename)
+                if success:
+                    file_info = {
+                        "id": file_id,
+                        "name": file.filename,
+                        "etag": str(hash(content))[:32],
+                        "size": len(content),
+                        "lastModifiedDateTime": datetime.utcnow().isoformat()
+                    }
+                    # Complete by the time create_vectorstore writes the manifest
+                    file_metadata.append(file_info)
+                    yield file_info, text
+        
+        # Create vector store (saved together with its file manifest)
         logger.info("Creating vector store...")
-        vectorstore = vector_store_manager.create_vectorstore(combined_text, hub_name)
+        vectorstore = await vector_store_manager.create_vectorstore(hub_name, file_metadata, extract_uploaded_files())
+        
+        if vectorstore is None:
+            raise HTTPException(status_code=400, detail="No text could be extracted from uploaded files")
         
-        # Save manifest and metadata
-        vector_store_manager.save_manifest(hub_name, file_metadata)
+        # Save metadata
         vector_store_manager.save_metadata(hub_name, {
             "created_at": datetime.utcnow().isoformat(),
             "source": "upload"
@@ -321,8 +337,8 @@ async def load_hub(hub_name: str):
     If auto_sync is enabled, checks SharePoint for updates first
     """
     try:
-        # Check if already loaded
-        if app_state.get_hub(hub_name):
+        # Check if already loaded (and not since synced by another server worker)
+        if app_state.get_hub(hub_name, vector_store_manager.current_version(hub_name)):
             return {
                 "status": "success",
                 "message": f"Hub '{hub_name}' is already loaded",
@@ -345,8 +361,8 @@ async def load_hub(hub_name: str):
                 sharepoint_link = metadata["sharepoint_link"]
                 
                 # Get current files from SharePoint
-                item_json = sharepoint_client.share_link_to_drive_item(sharepoint_link)
-                current_files = sharepoint_client.collect_files_recursively(item_json)
+                item_json = await sharepoint_client.share_link_to_drive_item(sharepoint_link)
+                current_files = await sharepoint_client.collect_files_recursively(item_json, refresh=True)
                 
                 # Compare with existing manifest
                 old_manifest = vector_store_manager.load_manifest(hub_name) or {}
@@ -364,19 +380,24 @@ async def load_hub(hub_name: str):
                     
                     logger.info(f"  📊 Changes: +{added} files, ~{modified} modified, -{removed} removed")
                     
-                    # Re-process files
-                    all_text = parallel_processor.process_files_parallel(
-                        files=current_files,
+                    # Re-process only new/modified files
+                    changed_files = await vector_store_manager.changed_files(hub_name, current_files)
+                    texts = parallel_processor.stream_files_parallel(
+                        files=changed_files,
                         download_func=sharepoint_client.download_file,
                         extract_func=file_extractor.extract
                     )
                     
-                    if all_text.strip():
-                        # Rebuild vector store
-                        vectorstore = vector_store_manager.create_vectorstore(all_text, hub_name)
+                    # Update vector store in place (saved together with its file manifest)
+                    vectorstore = await vector_store_manager.update_vectorstore(hub_name, current_files, texts)
+                    
+                    if vectorstore is not None:
+                        # Files that failed to process keep their old manifest entry and are retried next sync
+                        failed = len(await vector_store_manager.changed_files(hub_name, changed_files))
+                        if failed:
+                            logger.warning(f"⚠️ {failed} changed files could not be processed, will retry on next sync")
                         
-                        # Update manifest and metadata
-                        vector_store_manager.save_manifest(hub_name, current_files)
+                        # Update metadata
                         metadata["last_synced"] = datetime.utcnow().isoformat()
                         metadata["sync_count"] = metadata.get("sync_count", 0) + 1
                         vector_store_manager.save_metadata(hub_name, metadata)
@@ -394,7 +415,9 @@ async def load_hub(hub_name: str):
         
         # Load vector store (either updated or existing)
         logger.info(f"Loading hub into memory: {hub_name}")
-        vectorstore = vector_store_manager.load_vectorstore(hub_name)
+        vectorstore, version = await asyncio.to_thread(
+            vector_store_manager.load_vectorstore_with_version, hub_name
+        )
         
         if not vectorstore:
             raise HTTPException(status_code=404, detail=f"Hub '{hub_name}' vector store not found")
@@ -403,7 +426,7 @@ async def load_hub(hub_name: str):
         qa_chain = qa_engine_builder.build_qa_chain(vectorstore)
         
         # Store in application state
-        app_state.set_hub(hub_name, qa_chain, vectorstore)
+        app_state.set_hub(hub_name, qa_chain, vectorstore, version)
         
         logger.info(f"✅ Successfully loaded hub: {hub_name}")
         
@@ -434,29 +457,34 @@ async def chat(request: ChatRequest):
     Query documents in a loaded hub
     """
     try:
-        # Check if hub is loaded
-        hub_data = app_state.get_hub(request.hub_name)
+        # Check if hub is loaded; a copy older than the saved version (another server worker
+        # synced the hub) or of a deleted hub counts as not loaded
+        version = vector_store_manager.current_version(request.hub_name)
+        hub_data = app_state.get_hub(request.hub_name, version) if version else None
         
         if not hub_data:
             # Try to load it automatically
-            logger.info(f"Hub '{request.hub_name}' not loaded, loading now...")
-            vectorstore = vector_store_manager.load_vectorstore(request.hub_name)
+            logger.info(f"Hub '{request.hub_name}' not loaded or changed on disk, loading now...")
+            vectorstore, version = await asyncio.to_thread(
+                vector_store_manager.load_vectorstore_with_version, request.hub_name
+            )
             
             if not vectorstore:
+                app_state.remove_hub(request.hub_name)
                 raise HTTPException(
                     status_code=404,
                     detail=f"Hub '{request.hub_name}' not found. Please load or create it first."
                 )
             
             qa_chain = qa_engine_builder.build_qa_chain(vectorstore)
-            app_state.set_hub(request.hub_name, qa_chain, vectorstore)
+            app_state.set_hub(request.hub_name, qa_chain, vectorstore, version)
             hub_data = app_state.get_hub(request.hub_name)
         
         qa_chain = hub_data["qa"]
         
         # Execute query
         logger.info(f"Processing query for hub '{request.hub_name}': {request.query[:50]}...")
-        result = qa_chain({"query": request.query})
+        result = await qa_chain.ainvoke({"query": request.query})
         
         # Format response
         sources = None
@@ -504,8 +532,8 @@ async def sync_hub(hub_name: str, force: bool = False):
         
         # Get current files from SharePoint
         logger.info(f"Checking SharePoint for updates: {hub_name}")
-        item_json = sharepoint_client.share_link_to_drive_item(sharepoint_link)
-        current_files = sharepoint_client.collect_files_recursively(item_json)
+        item_json = await sharepoint_client.share_link_to_drive_item(sharepoint_link)
+        current_files = await sharepoint_client.collect_files_recursively(item_json, refresh=True)
         
         # Load existing manifest
         old_manifest = vector_store_manager.load_manifest(hub_name) or {}
@@ -526,33 +554,50 @@ async def sync_hub(hub_name: str, force: bool = False):
                 message="No changes detected in SharePoint"
             )
         
-        # Re-process files
+        # Re-process new/modified files (all files when forced)
         logger.info(f"Changes detected, re-processing files for hub: {hub_name}")
-        all_text = parallel_processor.process_files_parallel(
-            files=current_files,
+        changed_files = current_files if force else await vector_store_manager.changed_files(hub_name, current_files)
+        texts = parallel_processor.stream_files_parallel(
+            files=changed_files,
             download_func=sharepoint_client.download_file,
             extract_func=file_extractor.extract
         )
         
-        # Rebuild vector store
-        vectorstore = vector_store_manager.create_vectorstore(all_text, hub_name)
+        # Rebuild vector store, or update it in place with just the changes; either way the
+        # file manifest is saved together with the index
+        if force:
+            vectorstore = await vector_store_manager.create_vectorstore(hub_name, current_files, texts)
+        else:
+            vectorstore = await vector_store_manager.update_vectorstore(hub_name, current_files, texts)
         
-        # Update manifest and metadata
-        vector_store_manager.save_manifest(hub_name, current_files)
+        if vectorstore is None:
+            raise HTTPException(status_code=400, detail="No text could be extracted from SharePoint files")
+        
+        # Update metadata
         metadata["last_synced"] = datetime.utcnow().isoformat()
         vector_store_manager.save_metadata(hub_name, metadata)
         
-        # Update in-memory hub if loaded
+        # Update in-memory hub if loaded, from disk so it is stamped with the version it came from
         if app_state.get_hub(hub_name):
+            vectorstore, version = await asyncio.to_thread(
+                vector_store_manager.load_vectorstore_with_version, hub_name
+            )
             qa_chain = qa_engine_builder.build_qa_chain(vectorstore)
-            app_state.set_hub(hub_name, qa_chain, vectorstore)
+            app_state.set_hub(hub_name, qa_chain, vectorstore, version)
+        
+        # Files that failed to process are still pending and will be retried on the next sync
+        failed = len(await vector_store_manager.changed_files(hub_name, changed_files))
+        updated = len(changed_files) - failed
+        message = f"Successfully synced {updated} changed files from SharePoint"
+        if failed:
+            message += f" ({failed} failed and will be retried on the next sync)"
         
         return SyncResponse(
             hub_name=hub_name,
             status="success",
             changes_detected=True,
-            files_updated=len(current_files),
-            message=f"Successfully synced {len(current_files)} files from SharePoint"
+            files_updated=updated,
+            message=message
         )
     
     except HTTPException:
@@ -575,7 +620,7 @@ async def delete_hub(hub_name: str):
         app_state.remove_hub(hub_name)
         
         # Delete from disk
-        vector_store_manager.delete_hub(hub_name)
+        await asyncio.to_thread(vector_store_manager.delete_hub, hub_name)
         
         return {
             "status": "success",
@@ -1,114 +1,169 @@
 # utils/parallel.py
+import asyncio
 import concurrent.futures
-import threading
-from typing import List, Dict, Any, Callable
+import os
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Any, AsyncIterator, Callable, Awaitable, BinaryIO, Optional, Tuple, Union
 import logging
+from services.process_pool import LazyProcessPool, mp_context
 
 logger = logging.getLogger(__name__)
 
 
+def _file_key(file_info: Dict[str, Any]) -> str:
+    return file_info.get("id") or file_info.get("name")
+
+
+def _worker_source(content: BinaryIO) -> Union[bytes, str]:
+    """What to send a worker for a downloaded file: the path of a file on disk, else its bytes"""
+    name = getattr(content, "name", None)
+    if isinstance(name, str):
+        return name
+    return content.getvalue()
+
+
+def _extract_in_worker(extract_func: Callable[[Any, str], tuple[str, bool]],
+                       source: Union[bytes, str], filename: str) -> tuple[str, bool]:
+    """Run extraction in a worker process, opening files on disk there rather than shipping their bytes"""
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            return extract_func(f, filename)
+    return extract_func(source, filename)
+
+
 class ParallelProcessor:
-    """Handle parallel processing of files with configurable workers and batching"""
+    """Handle parallel processing of files as a download -> extract pipeline"""
 
-    def __init__(self, max_workers: int = 10, batch_size: int = 20):
+    def __init__(self, max_workers: int = 10, batch_size: int = 20, extract_workers: Optional[int] = None):
         self.max_workers = max_workers
         self.batch_size = batch_size
-        self._lock = threading.Lock()
+        self.extract_workers = extract_workers or os.cpu_count() or 1
+        self._extract_pool = LazyProcessPool()
+
+    async def _run_extract(self, extract_func: Callable[[Any, str], tuple[str, bool]],
+                           source: Union[bytes, str], filename: str) -> tuple[str, bool]:
+        """Run extraction in the process pool, replacing the pool if a worker died"""
+        loop = asyncio.get_running_loop()
+        executor = self._extract_pool.get(self.extract_workers)
+        try:
+            return await loop.run_in_executor(executor, _extract_in_worker, extract_func, source, filename)
+        except BrokenProcessPool:
+            # A worker segfaulted or was killed, and every task on the pool fails with it
+            self._extract_pool.discard(executor)
+        
+        # Retry alone in a throwaway process: if this file crashed the pool, it takes down nothing else
+        logger.warning(f"Extraction pool broke while processing {filename}; retrying in a separate process")
+        isolated = concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=mp_context())
+        try:
+            return await loop.run_in_executor(isolated, _extract_in_worker, extract_func, source, filename)
+        finally:
+            isolated.shutdown(wait=False)
+
+    def close(self):
+        """Shut down the extraction process pool"""
+        self._extract_pool.shutdown(wait=True)
 
-    def process_files_parallel(
+    async def stream_files_parallel(
         self,
         files: List[Dict[str, Any]],
-        download_func: Callable[[str], bytes],
-        extract_func: Callable[[bytes, str], tuple[str, bool]]
-    ) -> str:
+        download_func: Callable[[str], Awaitable[BinaryIO]],
+        extract_func: Callable[[Any, str], tuple[str, bool]]
+    ) -> AsyncIterator[Tuple[Dict[str, Any], str]]:
         """
-        Process files in parallel: download and extract text
+        Download and extract files in parallel, yielding each text as soon as it's ready
 
         Args:
             files: List of file metadata dicts with 'downloadUrl' and 'name' keys
-            download_func: Function to download file content (takes download_url)
-            extract_func: Function to extract text (takes content, filename) -> (text, success)
+            download_func: Coroutine function to download file content (takes download_url) -> BytesIO or named file
+            extract_func: Picklable function to extract text (takes bytes or a binary file, filename) -> (text, success)
 
-        Returns:
-            Combined extracted text from all files
+        Yields:
+            (file_info, text) in completion order; files that failed are skipped
         """
         if not files:
-            return ""
-
-        logger.info(f"Processing {len(files)} files with {self.max_workers} workers")
-
-        # Process in batches to avoid overwhelming the system
-        all_texts = []
-        for i in range(0, len(files), self.batch_size):
-            batch = files[i:i + self.batch_size]
-            logger.info(f"Processing batch {i//self.batch_size + 1}/{(len(files) + self.batch_size - 1)//self.batch_size}")
+            return
 
-            batch_texts = self._process_batch(batch, download_func, extract_func)
-            all_texts.extend(batch_texts)
+        logger.info(f"Processing {len(files)} files with {self.max_workers} download workers "
+                    f"and {self.extract_workers} extract workers")
 
-        # Combine all extracted texts
-        combined_text = "\n\n".join(all_texts)
-        successful_extractions = len([t for t in all_texts if t.strip()])
+        queue: asyncio.Queue = asyncio.Queue(maxsize=2 * self.batch_size)
+        results: asyncio.Queue = asyncio.Queue(maxsize=self.extract_workers)
+        semaphore = asyncio.Semaphore(self.max_workers)
 
-        logger.info(f"Successfully extracted text from {successful_extractions}/{len(files)} files")
-        return combined_text
-
-    def _process_batch(
-        self,
-        batch: List[Dict[str, Any]],
-        download_func: Callable[[str], bytes],
-        extract_func: Callable[[bytes, str], tuple[str, bool]]
-    ) -> List[str]:
-        """Process a single batch of files"""
-        texts = []
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # Submit all tasks
-            future_to_file = {
-                executor.submit(self._process_single_file, file_info, download_func, extract_func): file_info
-                for file_info in batch
-            }
-
-            # Collect results as they complete
-            for future in concurrent.futures.as_completed(future_to_file):
-                file_info = future_to_file[future]
-                try:
-                    text = future.result()
-                    texts.append(text)
-                except Exception as e:
-                    logger.error(f"Failed to process file {file_info.get('name', 'unknown')}: {e}")
-                    texts.append("")  # Add empty string to maintain order
-
-        return texts
-
-    def _process_single_file(
-        self,
-        file_info: Dict[str, Any],
-        download_func: Callable[[str], bytes],
-        extract_func: Callable[[bytes, str], tuple[str, bool]]
-    ) -> str:
-        """Process a single file: download and extract"""
-        try:
+        async def _download(file_info: Dict[str, Any]):
             download_url = file_info.get("downloadUrl") or file_info.get("download_url")
             filename = file_info.get("name", "unknown")
 
             if not download_url:
                 logger.warning(f"No download URL for file: {filename}")
-                return ""
-
-            # Download file
-            content = download_func(download_url)
-
-            # Extract text
-            text, success = extract_func(content, filename)
+                return
 
-            if success and text.strip():
-                logger.debug(f"Successfully processed: {filename} ({len(text)} chars)")
-                return text
-            else:
-                logger.warning(f"Failed to extract text from: {filename}")
-                return ""
-
-        except Exception as e:
-            logger.error(f"Error processing file {file_info.get('name', 'unknown')}: {e}")
-            return ""
\ No newline at end of file
+            # Hold the slot until the file is queued so a full queue throttles downloads
+            async with semaphore:
+                try:
+                    content = await download_func(download_url)
+                except Exception as e:
+                    logger.error(f"Error downloading file {filename}: {e}")
+                    return
+                await queue.put((file_info, content))
+
+        async def _produce():
+            await asyncio.gather(*[_download(file_info) for file_info in files])
+            for _ in range(self.extract_workers):
+                await queue.put(None)
+
+        async def _extract():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+
+                file_info, content = item
+                filename = file_info.get("name", "unknown")
+                try:
+                    text, success = await self._run_extract(extract_func, _worker_source(content), filename)
+                except Exception as e:
+                    logger.error(f"Error processing file {filename}: {e}")
+                    continue
+                finally:
+                    if hasattr(content, "close"):
+                        content.close()
+
+                if not success:
+                    logger.warning(f"Failed to extract text from: {filename}")
+                    continue
+                if text.strip():
+                    logger.debug(f"Successfully processed: {filename} ({len(text)} chars)")
+                else:
+                    logger.warning(f"No text found in: {filename}")
+                await results.put((file_info, text))
+
+        async def _run():
+            try:
+                await asyncio.gather(_produce(), *[_extract() for _ in range(self.extract_workers)])
+            finally:
+                # Once cancelled nobody reads the results, so a put could block forever
+                if not asyncio.current_task().cancelling():
+                    await results.put(None)
+
+        pipeline = asyncio.create_task(_run())
+        extracted = 0
+        try:
+            while True:
+                item = await results.get()
+                if item is None:
+                    break
+                extracted += 1
+                yield item
+            await pipeline
+        finally:
+            # The caller stopped early (error or cancellation): stop downloading and extracting
+            if not pipeline.done():
+                pipeline.cancel()
+                await asyncio.gather(pipeline, return_exceptions=True)
+                while not queue.empty():
+                    item = queue.get_nowait()
+                    if item is not None and hasattr(item[1], "close"):
+                        item[1].close()
+
+        logger.info(f"Successfully processed {extracted}/{len(files)} files")
@@ -1,30 +1,56 @@
 # state.py
 from typing import Dict, Optional, Any
 import threading
+import logging
+from cachetools import LRUCache
+
+from config import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+class _HubCache(LRUCache):
+    """LRU cache of loaded hubs that logs evictions"""
+    
+    def popitem(self):
+        hub_name, hub = super().popitem()
+        # Dropping the last reference frees the FAISS index once in-flight queries finish
+        logger.info(f"Evicting least recently used hub from memory: {hub_name}")
+        return hub_name, hub
 
 
 class ApplicationState:
     """Thread-safe application state management"""
     
-    def __init__(self):
+    def __init__(self, max_loaded_hubs: int = 10):
         self._lock = threading.RLock()
-        self._loaded_hubs: Dict[str, Dict] = {}
-        # Cache structure: {hub_name: {"qa": Any, "vectorstore": Any, "loaded_at": datetime}}
+        # Bounded: each hub holds a full FAISS index, so least recently used hubs are evicted
+        self._loaded_hubs: Dict[str, Dict] = _HubCache(maxsize=max_loaded_hubs)
+        # Cache structure: {hub_name: {"qa": Any, "vectorstore": Any, "version": str, "loaded_at": datetime}}
     
-    def set_hub(self, hub_name: str, qa: Any, vectorstore: Any):
-        """Load a hub into memory"""
+    def set_hub(self, hub_name: str, qa: Any, vectorstore: Any, version: Optional[str] = None):
+        """Load a hub into memory, stamped with the saved version it was loaded from"""
         from datetime import datetime
         with self._lock:
             self._loaded_hubs[hub_name] = {
                 "qa": qa,
                 "vectorstore": vectorstore,
+                "version": version,
                 "loaded_at": datetime.utcnow()
             }
     
-    def get_hub(self, hub_name: str) -> Optional[Dict]:
-        """Retrieve loaded hub"""
+    def get_hub(self, hub_name: str, version: Optional[str] = None) -> Optional[Dict]:
+        """
+        Retrieve loaded hub
+        
+        With ``version`` (the hub's current saved version), a copy loaded from another
+        version, e.g. before another server worker synced the hub, counts as not loaded.
+        """
         with self._lock:
-            return self._loaded_hubs.get(hub_name)
+            hub = self._loaded_hubs.get(hub_name)
+        if hub is not None and version is not None and hub["version"] != version:
+            return None
+        return hub
     
     def remove_hub(self, hub_name: str):
         """Unload hub from memory"""
@@ -44,4 +70,4 @@ class ApplicationState:
 
 
 # Global state instance
-app_state = ApplicationState()
\ No newline at end of file
+app_state = ApplicationState(max_loaded_hubs=get_settings().MAX_LOADED_HUBS)
\ No newline at end of file